@@ -0,0 +1,38 @@
+"""
+Shared filesystem lookup helpers for the userspace scripts.
+
+- `which`: `shutil.which` costs one access() per PATH entry for every lookup.
+  The scripts resolve the same few tools (v4l2-ctl, libcamera-still, ...) from
+  several places, so results are cached once per process.
+- `list_video_nodes`: the /dev/video* character devices, scanned once per
+  process and ordered by node number.
+"""
+
+import functools
+import os
+import shutil
+from typing import Optional, Tuple, Union
+
+
+@functools.lru_cache(maxsize=None)
+def which(tool: str) -> Optional[str]:
+    return shutil.which(tool)
+
+
+def _node_number(path: str) -> Tuple[int, Union[int, str]]:
+    # Numeric order, so /dev/video10 sorts after /dev/video2; anything that
+    # isn't videoN goes last in name order.
+    suffix = path.rsplit("video", 1)[1]
+    return (0, int(suffix)) if suffix.isdigit() else (1, suffix)
+
+
+@functools.lru_cache(maxsize=None)
+def list_video_nodes() -> Tuple[str, ...]:
+    # DirEntry.is_char_device() answers from readdir's d_type where the
+    # filesystem provides it, so each node is not stat'd a second time.
+    # A prefix check replaces glob's fnmatch regex.
+    with os.scandir("/dev") as it:
+        nodes = [
+            e.path for e in it if e.name.startswith("video") and e.is_char_device()
+        ]
+    return tuple(sorted(nodes, key=_node_number))
@@ -0,0 +1,283 @@
+"""
+Minimal read-only V4L2 queries issued directly via ioctl.
+
+This covers the subset of `v4l2-ctl` that the snapshot tool needs:
+- VIDIOC_QUERYCAP for driver/card/bus info and capability bits.
+- VIDIOC_ENUM_FMT / VIDIOC_ENUM_FRAMESIZES / VIDIOC_ENUM_FRAMEINTERVALS to
+  reproduce what `v4l2-ctl --list-formats-ext` reports.
+
+Struct layouts and ioctl numbers follow `linux/videodev2.h` using the generic
+_IOC encoding (ARM, arm64, x86), which is what the Raspberry Pi uses. Nothing
+here changes device state; nodes are opened non-blocking only to ask questions.
+"""
+
+import errno
+import fcntl
+import os
+import struct
+from typing import Any, Dict, List, Tuple
+
+# --- ioctl request encoding (asm-generic/ioctl.h) ---------------------------
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _ioc(direction: int, nr: int, size: int) -> int:
+    return (direction << 30) | (size << 16) | (ord("V") << 8) | nr
+
+
+# --- struct layouts (linux/videodev2.h) --------------------------------------
+
+# struct v4l2_capability: driver[16], card[32], bus_info[32], version,
+# capabilities, device_caps, reserved[3]
+_CAPABILITY = struct.Struct("=16s32s32sIII3I")
+# struct v4l2_fmtdesc: index, type, flags, description[32], pixelformat,
+# mbus_code, reserved[3]
+_FMTDESC = struct.Struct("=III32sII3I")
+# struct v4l2_frmsizeenum: index, pixel_format, type, union (up to 6 u32),
+# reserved[2]
+_FRMSIZEENUM = struct.Struct("=III6I2I")
+# struct v4l2_frmivalenum: index, pixel_format, width, height, type,
+# union (up to 3 v4l2_fract), reserved[2]
+_FRMIVALENUM = struct.Struct("=IIIII6I2I")
+
+VIDIOC_QUERYCAP = _ioc(_IOC_READ, 0, _CAPABILITY.size)
+VIDIOC_ENUM_FMT = _ioc(_IOC_READ | _IOC_WRITE, 2, _FMTDESC.size)
+VIDIOC_ENUM_FRAMESIZES = _ioc(_IOC_READ | _IOC_WRITE, 74, _FRMSIZEENUM.size)
+VIDIOC_ENUM_FRAMEINTERVALS = _ioc(_IOC_READ | _IOC_WRITE, 75, _FRMIVALENUM.size)
+
+# --- constants ---------------------------------------------------------------
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_BUF_TYPE_VIDEO_CAPTURE_MPLANE = 9
+
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_VIDEO_CAPTURE_MPLANE = 0x00001000
+V4L2_CAP_VIDEO_M2M_MPLANE = 0x00004000
+V4L2_CAP_VIDEO_M2M = 0x00008000
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+# Names as printed by v4l2-ctl, so snapshots stay comparable across backends.
+CAP_NAMES = {
+    0x00000001: "Video Capture",
+    0x00000002: "Video Output",
+    0x00000004: "Video Overlay",
+    0x00000010: "VBI Capture",
+    0x00000020: "VBI Output",
+    0x00000040: "Sliced VBI Capture",
+    0x00000080: "Sliced VBI Output",
+    0x00000100: "RDS Capture",
+    0x00000200: "Video Output Overlay",
+    0x00000400: "HW Frequency Seek",
+    0x00000800: "RDS Output",
+    0x00001000: "Video Capture Multiplanar",
+    0x00002000: "Video Output Multiplanar",
+    0x00004000: "Video Memory-to-Memory Multiplanar",
+    0x00008000: "Video Memory-to-Memory",
+    0x00010000: "Tuner",
+    0x00020000: "Audio",
+    0x00040000: "Radio",
+    0x00080000: "Modulator",
+    0x00100000: "SDR Capture",
+    0x00200000: "Extended Pix Format",
+    0x00400000: "SDR Output",
+    0x00800000: "Metadata Capture",
+    0x01000000: "Read/Write",
+    0x04000000: "Streaming",
+    0x08000000: "Metadata Output",
+    0x10000000: "Touch Device",
+    0x20000000: "I/O MC",
+    0x80000000: "Device Capabilities",
+}
+
+BUF_TYPE_NAMES = {
+    V4L2_BUF_TYPE_VIDEO_CAPTURE: "Video Capture",
+    V4L2_BUF_TYPE_VIDEO_CAPTURE_MPLANE: "Video Capture Multiplanar",
+}
+
+_FRMSIZE_TYPES = {1: "discrete", 2: "continuous", 3: "stepwise"}
+_FRMIVAL_TYPES = {1: "discrete", 2: "continuous", 3: "stepwise"}
+
+# Enumeration ends with EINVAL; ENOTTY means the driver lacks the ioctl.
+_END_OF_ENUM = (errno.EINVAL, errno.ENOTTY)
+
+
+def _cstr(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+def _fourcc(code: int) -> str:
+    # Bit 31 marks the big-endian variant of a format (v4l2_fourcc_be).
+    be = code & (1 << 31)
+    name = (code & 0x7FFFFFFF).to_bytes(4, "little").decode("ascii", errors="replace")
+    return name + "-BE" if be else name
+
+
+def _cap_names(bits: int) -> List[str]:
+    return [name for bit, name in CAP_NAMES.items() if bits & bit]
+
+
+def _ioctl(fd: int, request: int, layout: struct.Struct, *fields: int) -> tuple:
+    """
+    Issue an ioctl on a zeroed `layout` buffer and return the unpacked result.
+
+    `fields` fill the leading u32 members (the inputs of every V4L2 enum call).
+    """
+    buf = bytearray(layout.size)
+    struct.pack_into(f"={len(fields)}I", buf, 0, *fields)
+    fcntl.ioctl(fd, request, buf, True)
+    return layout.unpack(buf)
+
+
+def _enum(fd: int, request: int, layout: struct.Struct, *fields: int) -> List[tuple]:
+    """Run an index-based V4L2 enumeration until the driver reports the end."""
+    results = []
+    index = 0
+    while True:
+        try:
+            results.append(_ioctl(fd, request, layout, index, *fields))
+        except OSError as e:
+            if e.errno in _END_OF_ENUM:
+                return results
+            raise
+        index += 1
+
+
+def _fract(numerator: int, denominator: int) -> Dict[str, int]:
+    return {"numerator": numerator, "denominator": denominator}
+
+
+def query_cap(fd: int) -> Tuple[Dict[str, Any], int]:
+    """Return VIDIOC_QUERYCAP as a dict plus the capability bits of this node."""
+    driver, card, bus_info, version, caps, device_caps, *_ = _ioctl(
+        fd, VIDIOC_QUERYCAP, _CAPABILITY
+    )
+    major, minor, patch = (version >> 16) & 0xFF, (version >> 8) & 0xFF, version & 0xFF
+    cap = {
+        "driver": _cstr(driver),
+        "card": _cstr(card),
+        "bus_info": _cstr(bus_info),
+        "version": f"{major}.{minor}.{patch}",
+        "capabilities": f"0x{caps:08x}",
+        "capability_names": _cap_names(caps),
+        "device_caps": f"0x{device_caps:08x}",
+        "device_cap_names": _cap_names(device_caps),
+    }
+    # `capabilities` describes the whole physical device; `device_caps` (when
+    # present) describes the node that was opened.
+    return cap, device_caps if caps & V4L2_CAP_DEVICE_CAPS else caps
+
+
+def capture_buf_types(bits: int) -> List[int]:
+    """Buffer types `--list-formats-ext` would enumerate for a node with `bits`."""
+    types = []
+    if bits & (V4L2_CAP_VIDEO_CAPTURE | V4L2_CAP_VIDEO_M2M):
+        types.append(V4L2_BUF_TYPE_VIDEO_CAPTURE)
+    if bits & (V4L2_CAP_VIDEO_CAPTURE_MPLANE | V4L2_CAP_VIDEO_M2M_MPLANE):
+        types.append(V4L2_BUF_TYPE_VIDEO_CAPTURE_MPLANE)
+    return types
+
+
+def _frame_intervals(
+    fd: int, pixfmt: int, width: int, height: int
+) -> List[Dict[str, Any]]:
+    intervals = []
+    for _, _, _, _, ival_type, *u, _r0, _r1 in _enum(
+        fd, VIDIOC_ENUM_FRAMEINTERVALS, _FRMIVALENUM, pixfmt, width, height
+    ):
+        kind = _FRMIVAL_TYPES.get(ival_type, str(ival_type))
+        if kind == "discrete":
+            intervals.append({"type": kind, **_fract(u[0], u[1])})
+        else:
+            intervals.append(
+                {
+                    "type": kind,
+                    "min": _fract(u[0], u[1]),
+                    "max": _fract(u[2], u[3]),
+                    "step": _fract(u[4], u[5]),
+                }
+            )
+    return intervals
+
+
+def _frame_sizes(fd: int, pixfmt: int) -> List[Dict[str, Any]]:
+    sizes = []
+    for _, _, size_type, *u, _r0, _r1 in _enum(
+        fd, VIDIOC_ENUM_FRAMESIZES, _FRMSIZEENUM, pixfmt
+    ):
+        kind = _FRMSIZE_TYPES.get(size_type, str(size_type))
+        if kind == "discrete":
+            width, height = u[0], u[1]
+            sizes.append(
+                {
+                    "type": kind,
+                    "width": width,
+                    "height": height,
+                    "intervals": _frame_intervals(fd, pixfmt, width, height),
+                }
+            )
+        else:
+            min_w, max_w, step_w, min_h, max_h, step_h = u
+            sizes.append(
+                {
+                    "type": kind,
+                    "min_width": min_w,
+                    "max_width": max_w,
+                    "step_width": step_w,
+                    "min_height": min_h,
+                    "max_height": max_h,
+                    "step_height": step_h,
+                }
+            )
+    return sizes
+
+
+def list_formats_ext(fd: int, buf_types: List[int]) -> List[Dict[str, Any]]:
+    formats = []
+    for buf_type in buf_types:
+        for index, _, flags, description, pixfmt, *_ in _enum(
+            fd, VIDIOC_ENUM_FMT, _FMTDESC, buf_type
+        ):
+            formats.append(
+                {
+                    "type": BUF_TYPE_NAMES[buf_type],
+                    "index": index,
+                    "pixelformat": _fourcc(pixfmt),
+                    "description": _cstr(description),
+                    "flags": f"0x{flags:08x}",
+                    "frame_sizes": _frame_sizes(fd, pixfmt),
+                }
+            )
+    return formats
+
+
+def query_node_cap(path: str) -> Tuple[Dict[str, Any], int]:
+    """
+    Open a node just for VIDIOC_QUERYCAP; see `query_cap`.
+
+    Raises OSError like `query_device`.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    try:
+        return query_cap(fd)
+    finally:
+        os.close(fd)
+
+
+def query_device(path: str) -> Dict[str, Any]:
+    """
+    Return {"caps": ..., "formats_ext": [...]} for a /dev/video* node.
+
+    Raises OSError if the node cannot be opened or does not answer
+    VIDIOC_QUERYCAP (e.g. it is not a V4L2 device).
+    """
+    fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    try:
+        cap, bits = query_cap(fd)
+        return {
+            "caps": cap,
+            "formats_ext": list_formats_ext(fd, capture_buf_types(bits)),
+        }
+    finally:
+        os.close(fd)
@@ -1,24 +1,74 @@
 #!/usr/bin/env python3
 """
-Snapshot V4L2 camera capabilities to a JSON file for offline inspection.
+Snapshot V4L2 camera capabilities to a file for offline inspection.
 
 This script is read-only: it does not modify device state or capture frames.
 It is intended to complement the interactive inspection tools by recording
 what the kernel V4L2 drivers expose at a point in time.
+
+Backends:
+- `ioctl` (default): queries each /dev/video* node directly with V4L2 ioctls
+  (see `_v4l2.py`) and records structured capabilities and formats.
+- `v4l2py`: same queries through the optional `v4l2py` binding, recording
+  the objects it builds; falls back to `ioctl` when it is not installed.
+- `v4l2-ctl`: shells out to `v4l2-ctl --all --list-formats-ext` for the
+  first capture node of each device and records its text output, for
+  comparison with what the CLI reports.
+
+Output is indented JSON by default (easy to diff and version alongside
+configs); `--format cbor` / `--format msgpack` write a smaller binary encoding
+of the same data for CI artefacts, using the optional `cbor2` / `msgpack`
+packages.
 """
 
+import argparse
+import asyncio
+import dataclasses
+import enum
+import hashlib
 import json
-import glob
 import os
-import shutil
-import subprocess
 import sys
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
+
+try:
+    # Optional: orjson is a much faster encoder; the stdlib json module keeps
+    # the script working on minimal Pi installs.
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    # Optional: higher-level binding over the same V4L2 ioctls.
+    from v4l2py import Device as V4l2pyDevice
+except ImportError:
+    V4l2pyDevice = None
+
+import _v4l2
+from _pathutil import list_video_nodes, which
+
+BACKENDS = ("ioctl", "v4l2py", "v4l2-ctl")
+# Backends whose output holds only static capabilities and format
+# enumerations. `v4l2-ctl --all` also records the current format, frame rate,
+# crop and control values, which change without touching the device nodes,
+# so its snapshots are never served from the cache.
+CACHEABLE_BACKENDS = ("ioctl", "v4l2py")
+FORMATS = ("json", "cbor", "msgpack")
 
 
 def find_v4l2_ctl() -> str:
-    path = shutil.which("v4l2-ctl")
+    path = which("v4l2-ctl")
     if path is None:
         print(
             "ERROR: `v4l2-ctl` not found in PATH.\n"
@@ -30,57 +80,398 @@ def find_v4l2_ctl() -> str:
     return path
 
 
-def run_v4l2_ctl(v4l2_ctl: str, args: List[str]) -> str:
-    cmd = [v4l2_ctl] + args
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        check=False,
+# Upper bound on v4l2-ctl processes running at once.
+MAX_CONCURRENT_QUERIES = 16
+
+
+async def run_v4l2_ctl(v4l2_ctl: str, args: List[str]) -> bytes:
+    """Run v4l2-ctl and return its raw stdout; decoding is left to the writer."""
+    # close_fds=False lets CPython launch via posix_spawn (vfork-style, no
+    # page-table copy) instead of fork+exec. Nothing is leaked: Python opens
+    # its fds (pipes, the snapshot file) non-inheritable by default.
+    proc = await asyncio.create_subprocess_exec(
+        v4l2_ctl,
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        close_fds=False,
     )
-    if result.returncode != 0:
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
         # Store stderr for debugging; return empty string for this section.
-        return f"ERROR (exit {result.returncode}): {result.stderr.strip()}"
-    return result.stdout
+        return b"ERROR (exit %d): %s" % (proc.returncode, stderr.strip())
+    return stdout
+
+
+# Header printed by `v4l2-ctl --list-formats-ext`; everything before it in a
+# combined `--all --list-formats-ext` run belongs to the `--all` section.
+FORMATS_EXT_HEADER = b"ioctl: VIDIOC_ENUM_FMT"
+
+
+def split_formats_ext(output: bytes) -> Tuple[bytes, bytes]:
+    """Split combined `--all --list-formats-ext` output into its two sections."""
+    idx = output.find(FORMATS_EXT_HEADER)
+    if idx == -1:
+        # Error text or a device without format enumeration: keep it under "all".
+        return output, b""
+    return output[:idx], output[idx:]
+
+
+def parse_list_devices(output: bytes) -> Dict[str, List[str]]:
+    """
+    Parse `v4l2-ctl --list-devices` into {device name: [/dev/video* nodes]}.
+
+    Each group is an unindented "name (bus):" line followed by indented node
+    paths; /dev/media* and /dev/v4l-subdev* entries are dropped.
+    """
+    groups: Dict[str, List[str]] = {}
+    nodes: List[str] = []
+    for line in output.decode("utf-8", errors="replace").splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            nodes = groups.setdefault(line.strip().rstrip(":"), [])
+        elif line.strip().startswith("/dev/video"):
+            nodes.append(line.strip())
+    return groups
+
+
+def device_cap_names(all_out: bytes) -> List[str]:
+    """Return the capability names listed under "Device Caps" in v4l2-ctl output."""
+    names: List[str] = []
+    in_device_caps = False
+    for line in all_out.splitlines():
+        if line.lstrip().startswith(b"Device Caps"):
+            in_device_caps = True
+        elif in_device_caps and line.startswith(b"\t\t"):
+            names.append(line.strip().decode("utf-8", errors="replace"))
+        elif in_device_caps:
+            break
+    return names
+
+
+def is_capture_node(all_out: bytes) -> bool:
+    # "Video Capture" or "Video Capture Multiplanar"; metadata and ISP
+    # output nodes lack both.
+    return any(name.startswith("Video Capture") for name in device_cap_names(all_out))
+
 
+def dumps_indented(obj: Any) -> bytes:
+    """Encode `obj` as UTF-8 JSON with a 2-space indent."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    # ensure_ascii=False matches orjson's raw UTF-8, so the file is byte-for-
+    # byte the same whether or not orjson is installed.
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
 
-def is_char_device(path: str) -> bool:
+
+def json_envelope_open(header: Dict[str, Any]) -> bytes:
+    """Return the snapshot JSON up to the opening bracket of "devices"."""
+    fields = "".join(
+        f"  {json.dumps(key, ensure_ascii=False)}: "
+        f"{json.dumps(value, ensure_ascii=False)},\n"
+        for key, value in header.items()
+    )
+    return ("{\n" + fields + '  "devices": [').encode("utf-8")
+
+
+def json_entry(entry: Dict[str, Any]) -> bytes:
+    # Indent to the nesting level of the "devices" list so the streamed file
+    # matches what json.dump(..., indent=2) would produce for the whole dict.
+    # Newlines inside string values are escaped, so every raw newline here
+    # is a line break of the encoder's layout.
+    return b"    " + dumps_indented(entry).replace(b"\n", b"\n    ")
+
+
+def json_envelope_close(has_devices: bool) -> bytes:
+    return b"\n  ]\n}" if has_devices else b"]\n}"
+
+
+def ioctl_entry(dev: str) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {"device": dev}
     try:
-        st = os.stat(path)
+        entry.update(_v4l2.query_device(dev))
+    except OSError as e:
+        # Store the error for debugging, mirroring the v4l2-ctl backend.
+        entry["error"] = f"ERROR: {e}"
+    return entry
+
+
+def _plain(obj: Any) -> Any:
+    """Convert v4l2py's dataclasses/namedtuples/enums into JSON-ready values."""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {f.name: _plain(getattr(obj, f.name)) for f in dataclasses.fields(obj)}
+    if hasattr(obj, "_asdict"):
+        return {k: _plain(v) for k, v in obj._asdict().items()}
+    if isinstance(obj, enum.Enum):
+        return obj.name if obj.name is not None else str(obj)
+    if isinstance(obj, dict):
+        return {str(k): _plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_plain(v) for v in obj]
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return str(obj)
+
+
+# Fields read from v4l2py's Device.info. Older releases return a namedtuple,
+# v4l2py >= 3 (a linuxpy re-export) a plain class with properties, so they
+# are read by name rather than by converting the object wholesale.
+V4L2PY_CAP_FIELDS = (
+    "driver",
+    "card",
+    "bus_info",
+    "version",
+    "capabilities",
+    "device_capabilities",
+    "buffers",
+)
+
+
+def v4l2py_entry(dev: str) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {"device": dev}
+    try:
+        with V4l2pyDevice(dev) as cam:
+            info = cam.info
+            caps = {
+                name: _plain(getattr(info, name, None)) for name in V4L2PY_CAP_FIELDS
+            }
+            formats_ext = {
+                "formats": _plain(getattr(info, "formats", None) or []),
+                "frame_sizes": _plain(getattr(info, "frame_sizes", None) or []),
+            }
+    except Exception as e:
+        # Third-party binding: any failure (not just OSError) is recorded for
+        # this device rather than aborting the whole snapshot.
+        entry["error"] = f"ERROR: {e}"
+        return entry
+    # Keep the same top-level layout as the ioctl backend.
+    entry["caps"] = caps
+    entry["formats_ext"] = formats_ext
+    return entry
+
+
+def node_caps(dev: str) -> Tuple[Optional[Dict[str, Any]], Optional[bool]]:
+    """
+    VIDIOC_QUERYCAP a node in-process: (caps, is capture node), or
+    (None, None) if the node can't be opened or queried.
+    """
+    try:
+        cap, bits = _v4l2.query_node_cap(dev)
     except OSError:
-        return False
-    return (st.st_mode & 0o170000) == 0o020000
+        return None, None
+    # Only true capture nodes, matching is_capture_node; M2M codec nodes
+    # (e.g. the Pi's /dev/video10-12) are skipped like ISP/meta nodes.
+    capture_bits = _v4l2.V4L2_CAP_VIDEO_CAPTURE | _v4l2.V4L2_CAP_VIDEO_CAPTURE_MPLANE
+    return cap, bool(bits & capture_bits)
+
+
+async def v4l2_ctl_group_entries(
+    v4l2_ctl: str, group: Optional[str], nodes: List[str], limit: asyncio.Semaphore
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Query the first capture node of a device group; other nodes are recorded
+    as belonging to it.
+
+    A sensor typically exposes several /dev/video* nodes (image, embedded
+    data, ISP stages) that report the same `--all` data, so only the first
+    one advertising Video Capture is queried with v4l2-ctl. Every node still
+    carries its caps from an in-process VIDIOC_QUERYCAP, which costs a single
+    ioctl rather than a process.
+    """
+    entries: Dict[str, Dict[str, Any]] = {}
+    primary = None
+    for dev in nodes:
+        entry: Dict[str, Any] = {"device": dev, "group": group}
+        entries[dev] = entry
+        cap, capture = node_caps(dev)
+        if cap is not None:
+            entry["caps"] = cap
+        if primary is not None:
+            entry["same_device_as"] = primary
+            continue
+        if capture is False:
+            continue
 
+        # Capture node, or QUERYCAP failed and v4l2-ctl has to tell us.
+        # One v4l2-ctl process answers both queries for the device.
+        async with limit:
+            out = await run_v4l2_ctl(
+                v4l2_ctl, ["--device", dev, "--all", "--list-formats-ext"]
+            )
+        all_out, formats_ext = split_formats_ext(out)
+        entry["all"] = all_out.decode("utf-8", errors="replace")
+        entry["formats_ext"] = formats_ext.decode("utf-8", errors="replace")
+        if capture or is_capture_node(all_out):
+            primary = dev
+    return entries
 
-def list_video_devices() -> List[str]:
-    devs = sorted(glob.glob("/dev/video*"))
-    return [d for d in devs if is_char_device(d)]
 
+def require_encoder(fmt: str) -> None:
+    """Exit early if the package needed for a binary output format is missing."""
+    module = {"cbor": cbor2, "msgpack": msgpack}.get(fmt, json)
+    if module is None:
+        package = "cbor2" if fmt == "cbor" else "msgpack"
+        print(
+            f"ERROR: --format {fmt} needs the `{package}` package "
+            f"(e.g. `pip install {package}`).",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def snapshot_key(devices: Tuple[str, ...], backend: str, fmt: str) -> str:
+    """
+    Hash what a snapshot depends on: the device nodes (their mtimes change
+    when udev recreates them on hotplug/driver reload), the running kernel,
+    and the options that shape the output.
+    """
+    stamps = []
+    for dev in devices:
+        try:
+            stamps.append((dev, os.stat(dev).st_mtime_ns))
+        except OSError:
+            stamps.append((dev, None))
+    h = hashlib.blake2b(repr(sorted(stamps)).encode("utf-8"))
+    h.update(os.uname().release.encode("utf-8"))
+    h.update(f"{backend}:{fmt}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def key_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.name + ".key")
+
+
+def entry_failed(entry: Dict[str, Any]) -> bool:
+    # ioctl/v4l2py backends record "error"; run_v4l2_ctl's error text ends up
+    # in the "all" section of a v4l2-ctl entry.
+    return "error" in entry or entry.get("all", "").startswith("ERROR (exit")
 
-def snapshot_caps(output_path: Path) -> None:
-    v4l2_ctl = find_v4l2_ctl()
-    devices = list_video_devices()
 
-    data: Dict[str, Any] = {
+async def snapshot_caps(
+    output_path: Path, backend: str = "ioctl", fmt: str = "json", force: bool = False
+) -> None:
+    require_encoder(fmt)
+    if backend == "v4l2py" and V4l2pyDevice is None:
+        print(
+            "WARNING: `v4l2py` is not installed; using the ioctl backend instead.",
+            file=sys.stderr,
+        )
+        backend = "ioctl"
+
+    devices = list_video_nodes()
+
+    # Skip all device queries when nothing the snapshot depends on changed.
+    cacheable = backend in CACHEABLE_BACKENDS
+    key = snapshot_key(devices, backend, fmt)
+    key_file = key_path(output_path)
+    if cacheable and not force and output_path.exists() and key_file.exists():
+        if key_file.read_text(encoding="utf-8").strip() == key:
+            print(f"Capability snapshot {output_path} is up to date (cached).")
+            return
+
+    v4l2_ctl = find_v4l2_ctl() if backend == "v4l2-ctl" else None
+
+    header: Dict[str, Any] = {
         "tool": "camera_caps_snapshot",
+        "backend": backend,
         "v4l2_ctl": v4l2_ctl,
-        "devices": [],
     }
 
-    for dev in devices:
-        entry: Dict[str, Any] = {
-            "device": dev,
-            "all": run_v4l2_ctl(v4l2_ctl, ["--device", dev, "--all"]),
-            "formats_ext": run_v4l2_ctl(
-                v4l2_ctl, ["--device", dev, "--list-formats-ext"]
-            ),
-        }
-        data["devices"].append(entry)
-
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with output_path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+
+    if v4l2_ctl is not None:
+        # Group nodes by the device that owns them (one --list-devices run) so
+        # each sensor/ISP is queried once rather than once per node. Nodes
+        # missing from the listing are queried on their own.
+        listed = parse_list_devices(
+            await run_v4l2_ctl(v4l2_ctl, ["--list-devices"])
+        )
+        group_of: Dict[str, Tuple[Optional[str], List[str]]] = {}
+        for name, nodes in listed.items():
+            nodes = [n for n in nodes if n in devices]
+            for n in nodes:
+                group_of[n] = (name, nodes)
+        for dev in devices:
+            group_of.setdefault(dev, (None, [dev]))
+
+        # v4l2-ctl processes mostly wait on fork/exec and ioctls, so launch
+        # every group up front and let the event loop service their pipes.
+        limit = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+        group_tasks: Dict[str, "asyncio.Task[Dict[str, Dict[str, Any]]]"] = {}
+        for dev in devices:
+            name, nodes = group_of[dev]
+            if nodes[0] not in group_tasks:
+                group_tasks[nodes[0]] = asyncio.create_task(
+                    v4l2_ctl_group_entries(v4l2_ctl, name, nodes, limit)
+                )
+
+        async def query(dev: str) -> Dict[str, Any]:
+            # Hand each entry over exactly once and drop the group's task once
+            # all of its nodes are out, so written entries can be freed.
+            _, nodes = group_of[dev]
+            entries = await group_tasks[nodes[0]]
+            entry = entries.pop(dev)
+            if not entries:
+                del group_tasks[nodes[0]]
+            return entry
+
+    else:
+        # Direct ioctls complete in microseconds; no processes to wait on, so
+        # each entry is built only when it is about to be written.
+        build_entry = v4l2py_entry if backend == "v4l2py" else ioctl_entry
+
+        async def query(dev: str) -> Dict[str, Any]:
+            return build_entry(dev)
+
+    # Invalidate the old key first and build the snapshot in a temporary file
+    # that only replaces the output once complete, so an interrupted run can't
+    # leave a partial file next to a key that still matches.
+    key_file.unlink(missing_ok=True)
+    failed = False
+
+    async def next_entry(dev: str) -> Dict[str, Any]:
+        nonlocal failed
+        entry = await query(dev)
+        failed = failed or entry_failed(entry)
+        return entry
+
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    try:
+        if fmt == "json":
+            # Entries are written in device order as their queries finish, so
+            # the output stays stable and each entry is released once it is
+            # on disk.
+            with tmp_path.open("wb") as f:
+                f.write(json_envelope_open(header))
+                for i, dev in enumerate(devices):
+                    f.write(b",\n" if i else b"\n")
+                    f.write(json_entry(await next_entry(dev)))
+                f.write(json_envelope_close(bool(devices)))
+        else:
+            data = dict(header, devices=[await next_entry(dev) for dev in devices])
+            with tmp_path.open("wb") as f:
+                if fmt == "cbor":
+                    cbor2.dump(data, f)
+                else:
+                    f.write(msgpack.packb(data))
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    # Only cache a clean snapshot: errors such as EACCES (user not in the
+    # `video` group) would otherwise stick until a device node changes.
+    if cacheable and failed:
+        print(
+            "WARNING: some devices could not be queried; the snapshot will not "
+            "be reused as a cache.",
+            file=sys.stderr,
+        )
+    elif cacheable:
+        key_file.write_text(key + "\n", encoding="utf-8")
 
     print(f"Wrote capability snapshot to {output_path}")
     print(
@@ -89,13 +480,49 @@ def snapshot_caps(output_path: Path) -> None:
     )
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Snapshot V4L2 camera capabilities to a file."
+    )
+    parser.add_argument(
+        "output",
+        nargs="?",
+        type=Path,
+        default=None,
+        help="Output file path (default: camera_caps_snapshot.<format>)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="ioctl",
+        help="How to query devices (default: ioctl, no subprocesses).",
+    )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="json",
+        help="Output encoding (default: json; cbor/msgpack are smaller).",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=(
+            "Re-query devices even if the cached snapshot is up to date "
+            "(ioctl/v4l2py only; the v4l2-ctl backend records live device "
+            "state such as the current format and controls, so it always "
+            "re-queries)."
+        ),
+    )
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = Path(f"camera_caps_snapshot.{args.format}")
+    return args
+
+
 def main() -> None:
-    # Default output path can be overridden via CLI arg if needed.
-    out = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("camera_caps_snapshot.json")
-    snapshot_caps(out)
+    args = parse_args()
+    asyncio.run(snapshot_caps(args.output, args.backend, args.format, args.force))
 
 
 if __name__ == "__main__":
     main()
-
-
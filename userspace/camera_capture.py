@@ -17,11 +17,12 @@ Userspace vs kernel driver:
 """
 
 import argparse
-import shutil
 import subprocess
 import sys
 from pathlib import Path
 
+from _pathutil import which
+
 
 def find_libcamera_tool() -> str:
     """
@@ -31,7 +32,7 @@ def find_libcamera_tool() -> str:
     to support other tools if needed.
     """
     for tool in ("libcamera-still", "libcamera-jpeg"):
-        path = shutil.which(tool)
+        path = which(tool)
         if path is not None:
             return path
 
@@ -91,7 +92,8 @@ def main() -> None:
     print(f"Capturing single image to: {args.output}")
 
     try:
-        subprocess.run(cmd, check=True)
+        # See run_v4l2_ctl in camera_caps_snapshot.py for close_fds=False.
+        subprocess.run(cmd, check=True, close_fds=False)
     except subprocess.CalledProcessError as e:
         print(
             f"ERROR: libcamera capture command failed with exit code {e.returncode}",
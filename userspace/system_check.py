@@ -11,33 +11,40 @@ aligned with the expected Raspberry Pi + USB camera setup:
 The goal is quick diagnostics, not capture or processing.
 """
 
-import shutil
 import subprocess
 import sys
-from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, List, Optional
+
+from _pathutil import list_video_nodes, which
 
 
 def banner(title: str) -> None:
-    print("=" * 72)
-    print(title)
-    print("=" * 72)
+    rule = "=" * 72
+    sys.stdout.write(f"{rule}\n{title}\n{rule}\n")
 
 
-def check_tools(tools: Iterable[str]) -> List[str]:
-    missing = []
+def check_tools(tools: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Print the status of each tool and return tool -> resolved path (or None)."""
+    resolved: Dict[str, Optional[str]] = {}
+    lines = []
     for t in tools:
-        path = shutil.which(t)
+        path = which(t)
         status = "OK" if path else "MISSING"
-        print(f"{t:16s}: {status}" + (f" ({path})" if path else ""))
-        if not path:
-            missing.append(t)
-    return missing
+        lines.append(f"{t:16s}: {status}" + (f" ({path})" if path else ""))
+        resolved[t] = path
+    if lines:
+        # One write for the whole table rather than one per tool.
+        sys.stdout.write("\n".join(lines) + "\n")
+    return resolved
 
 
 def run_cmd(cmd: List[str]) -> None:
+    # The child writes straight to our stdout fd; flush what we have buffered
+    # so its output lands after the section header, not before it.
+    sys.stdout.flush()
     try:
-        subprocess.run(cmd, check=True)
+        # See run_v4l2_ctl in camera_caps_snapshot.py for close_fds=False.
+        subprocess.run(cmd, check=True, close_fds=False)
     except FileNotFoundError:
         print(f"Command not found: {' '.join(cmd)}", file=sys.stderr)
     except subprocess.CalledProcessError as e:
@@ -47,37 +54,40 @@ def run_cmd(cmd: List[str]) -> None:
         )
 
 
-def main() -> None:
+def run_checks() -> None:
     banner("Camera System Sanity Check")
 
     # 1. Tool availability
     print("\n[1] Checking required tools in PATH")
     required = ["lsusb", "v4l2-ctl", "libcamera-still", "libcamera-jpeg"]
-    missing = check_tools(required)
+    tools = check_tools(required)
+    missing = [t for t, path in tools.items() if path is None]
 
     # 2. /dev/video* devices
     print("\n[2] Listing /dev/video* devices")
-    dev_dir = Path("/dev")
-    video_nodes = sorted(p for p in dev_dir.glob("video*") if p.is_char_device())
+    video_nodes = list_video_nodes()
     if not video_nodes:
         print("No /dev/video* nodes found.")
     else:
-        for p in video_nodes:
-            print(f"- {p}")
+        sys.stdout.write("".join(f"- {p}\n" for p in video_nodes))
 
     # 3. v4l2-ctl --list-devices (if available)
     print("\n[3] V4L2 devices via `v4l2-ctl --list-devices`")
-    if shutil.which("v4l2-ctl"):
-        run_cmd(["v4l2-ctl", "--list-devices"])
+    v4l2 = tools.get("v4l2-ctl")
+    if v4l2:
+        # Run the path check_tools resolved; a bare name would make exec walk
+        # PATH again.
+        run_cmd([v4l2, "--list-devices"])
     else:
         print("v4l2-ctl not available; skipping V4L2 device listing.")
 
     # 4. Summary
     print("\n[4] Summary")
     if missing:
-        print("Some tools are missing; install them to match the expected setup:")
-        for t in missing:
-            print(f"- {t}")
+        sys.stdout.write(
+            "Some tools are missing; install them to match the expected setup:\n"
+            + "".join(f"- {t}\n" for t in missing)
+        )
     else:
         print("All checked tools are present.")
 
@@ -85,6 +95,23 @@ def main() -> None:
     print("capture images or modify device configuration.")
 
 
+def main() -> None:
+    if sys.stdout.isatty():
+        run_checks()
+        return
+
+    # Piped/redirected (e.g. to a log collector): coalesce status lines into
+    # 8 KB writes, even when Python itself runs unbuffered (-u).
+    orig_stdout = sys.stdout
+    orig_stdout.flush()
+    with open(orig_stdout.fileno(), "w", buffering=8192, closefd=False) as out:
+        sys.stdout = out
+        try:
+            run_checks()
+        finally:
+            sys.stdout = orig_stdout
+
+
 if __name__ == "__main__":
     main()
 